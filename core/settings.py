@@ -16,7 +16,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("SECRET_KEY")
 
 
-DEBUG = os.getenv('DEBUG', 'True')
+# Parse the env string, any non-empty value such as 'False' would otherwise be truthy
+DEBUG = os.getenv('DEBUG', 'False').lower() in ('1', 'true', 'yes')
 
 
 
@@ -58,6 +59,10 @@ CACHES = {
         "LOCATION": os.getenv('REDIS_CACHE_URL', 'redis://127.0.0.1:6379/1'),
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            # Bounded, blocking pool so workers wait for a free connection instead of opening new sockets
+            "CONNECTION_POOL_CLASS": "redis.BlockingConnectionPool",
+            "CONNECTION_POOL_KWARGS": {"max_connections": 100, "timeout": 20, "socket_keepalive": True},
+            "SOCKET_TIMEOUT": 2,
         }
     }
 }
@@ -75,7 +80,10 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Tehran'
 
-CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+# All periodic tasks are defined in CELERY_BEAT_SCHEDULE, so beat keeps them in memory instead of
+# polling the database every tick. Set to 'django_celery_beat.schedulers:DatabaseScheduler' to manage
+# schedules from the admin.
+CELERY_BEAT_SCHEDULER = os.getenv('CELERY_BEAT_SCHEDULER', 'celery.beat:PersistentScheduler')
 
 CELERY_BEAT_SCHEDULE = {
     'cache_popular_urls_every_30_min': {
@@ -86,6 +94,10 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'urlshortener_count_log_click',
         'schedule': crontab(minute='*/4'),
     },
+    'flush_click_logs_every_1_min': {
+        'task': 'urlshortener_flush_click_logs',
+        'schedule': crontab(minute='*/1'),
+    },
 }
 
 
@@ -137,6 +149,8 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # Number of trusted reverse proxies in front of the app; 0 uses REMOTE_ADDR and ignores X-Forwarded-For
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
 }
 
 
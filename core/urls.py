@@ -18,7 +18,6 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from url_manager.views import RedirectApiView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
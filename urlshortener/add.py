@@ -1,23 +1,35 @@
 
 import json
+from pathlib import Path
 from urlshortener.models import ShortLink, Campaign
-import os
+
+LINKS_FILE = Path(__file__).resolve().parent / 'json' / 'links.json'
+
+
 def extract_links_data_to_models():
-    file_path = os.path.join('json', 'links.json')
-    print(file_path)
-    with open(file_path, 'r', encoding='utf-8') as file:
+    """
+    Reads links from urlshortener/json/links.json and bulk inserts valid ones under the 'Digikala' campaign.
+    Links that already exist are skipped. Returns the number of valid links submitted and of invalid links.
+    """
+    with open(LINKS_FILE, 'r', encoding='utf-8') as file:
         links = json.load(file)['links']
 
     campaign, created = Campaign.objects.get_or_create(name="Digikala")
 
+    short_links = []
+    invalid = 0
     for link in links:
         if ShortLink.is_valid_url(link):
-            short_link, created = ShortLink.objects.get_or_create(original_url=link, campaign=campaign)
-            if created:
-                print(f"Created ShortLink for {link}")
-            else:
-                print(f"ShortLink for {link} already exists")
+            # bulk_create skips save(), so fill the derived fields here
+            short_links.append(ShortLink(
+                original_url=link,
+                url_hash=ShortLink.hash_url(link),
+                short_code=ShortLink.generate_short_code(link),
+                campaign=campaign,
+            ))
         else:
-            print(f"Invalid URL: {link}")
+            invalid += 1
 
+    ShortLink.objects.bulk_create(short_links, ignore_conflicts=True, batch_size=500)
+    return len(short_links), invalid
 
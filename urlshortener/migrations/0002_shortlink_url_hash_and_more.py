@@ -0,0 +1,105 @@
+# Generated by Django 5.1.6 on 2026-10-14 13:15
+
+import base64
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def hash_url(url):
+    """
+    Copy of ShortLink.hash_url at the time of this migration.
+    """
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+def generate_short_code(original_url):
+    """
+    Copy of ShortLink.generate_short_code at the time of this migration.
+    """
+    secret = settings.SECRET_KEY.encode()
+    key = secret if len(secret) <= 64 else hashlib.blake2b(secret).digest()
+    encoded_url = base64.urlsafe_b64encode(original_url.encode()).decode().rstrip('=')
+    return encoded_url + hashlib.blake2b(encoded_url.encode(), key=key, digest_size=2).hexdigest()
+
+
+def check_duplicate_short_links(apps, schema_editor):
+    """
+    Refuses to migrate while two short links would break the unique short_code or (campaign, url_hash)
+    constraints. Runs before any schema change, since MySQL can't roll back DDL if an index fails halfway.
+    """
+    ShortLink = apps.get_model('urlshortener', 'ShortLink')
+    first_ids = {'short_code': {}, '(campaign, url_hash)': {}}
+    duplicates = {name: {} for name in first_ids}
+    rows = ShortLink.objects.values_list('id', 'original_url', 'short_code', 'campaign_id').order_by('id')
+    for link_id, original_url, short_code, campaign_id in rows.iterator(chunk_size=500):
+        keys = {'short_code': hashlib.md5((short_code or generate_short_code(original_url)).encode()).digest()}
+        if campaign_id is not None:  # NULL campaigns never clash in the unique constraint
+            keys['(campaign, url_hash)'] = (campaign_id, hash_url(original_url))
+        for name, key in keys.items():
+            first_id = first_ids[name].setdefault(key, link_id)
+            if first_id != link_id:
+                duplicates[name].setdefault(first_id, [first_id]).append(link_id)
+
+    errors = [
+        f"{len(groups)} groups of ShortLink rows share a {name} (ids: "
+        + '; '.join(', '.join(map(str, ids)) for ids in list(groups.values())[:20]) + ")"
+        for name, groups in duplicates.items() if groups
+    ]
+    if errors:
+        raise RuntimeError('. '.join(errors) + ". Merge or delete the duplicates, then run the migration again.")
+
+
+def backfill_short_links(apps, schema_editor):
+    """
+    Fills url_hash for existing short links and short_code where it is still empty,
+    before the unique constraints are added.
+    """
+    ShortLink = apps.get_model('urlshortener', 'ShortLink')
+    batch = []
+    for short_link in ShortLink.objects.only('id', 'original_url', 'short_code').iterator(chunk_size=500):
+        short_link.url_hash = hash_url(short_link.original_url)
+        if not short_link.short_code:
+            short_link.short_code = generate_short_code(short_link.original_url)
+        batch.append(short_link)
+        if len(batch) >= 500:
+            ShortLink.objects.bulk_update(batch, ['url_hash', 'short_code'])
+            batch.clear()
+    if batch:
+        ShortLink.objects.bulk_update(batch, ['url_hash', 'short_code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urlshortener', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_short_links, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='shortlink',
+            name='url_hash',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.AlterField(
+            model_name='shortlink',
+            name='short_code',
+            field=models.CharField(blank=True, db_collation='ascii_bin', max_length=2048, null=True),
+        ),
+        migrations.RunPython(backfill_short_links, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='shortlink',
+            name='short_code',
+            field=models.CharField(blank=True, db_collation='ascii_bin', max_length=2048, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='shortlink',
+            index=models.Index(fields=['click_count'], name='urlshortene_click_c_f1bcec_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shortlink',
+            constraint=models.UniqueConstraint(fields=('campaign', 'url_hash'), name='unique_shortlink_campaign_url'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.6 on 2026-10-14 13:15
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import MD5
+
+
+def backfill_click_logs(apps, schema_editor):
+    """
+    Fills url_hash for existing click logs in one UPDATE so they keep showing up in click reports.
+    """
+    ClickLog = apps.get_model('urlshortener', 'ClickLog')
+    ClickLog.objects.filter(url_hash='').update(url_hash=MD5('original_url'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urlshortener', '0002_shortlink_url_hash_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clicklog',
+            name='url_hash',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(backfill_click_logs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='clicklog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='clicklog',
+            index=models.Index(fields=['url_hash', 'created_at'], name='urlshortene_url_has_2727a3_idx'),
+        ),
+    ]
@@ -2,7 +2,6 @@
 
 import uuid
 from urllib.parse import urlparse, urlunparse
-import json
 from django.db import models
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
@@ -12,8 +11,30 @@ import hashlib
 from django.conf import settings
 import base64
 from urllib.parse import unquote
-import zlib
 from django.core.cache import cache
+from django.utils import timezone
+
+# Keyed hash states are built once and copied per short code instead of re-deriving them on every call.
+_SECRET = settings.SECRET_KEY.encode()
+_SIG_LEN = 4
+# BLAKE2b keys are limited to 64 bytes, longer secrets are hashed down first.
+_BLAKE2_KEY = _SECRET if len(_SECRET) <= 64 else hashlib.blake2b(_SECRET).digest()
+_BLAKE2_PROTO = hashlib.blake2b(key=_BLAKE2_KEY, digest_size=_SIG_LEN // 2)
+# HMAC-SHA256 signed short codes created before the BLAKE2b switch are still accepted on read.
+_LEGACY_HMAC_PROTO = hmac.new(_SECRET, digestmod=hashlib.sha256)
+_URL_VALIDATOR = URLValidator(schemes=['http', 'https'])
+
+
+def _sign(encoded_url):
+    h = _BLAKE2_PROTO.copy()
+    h.update(encoded_url.encode())
+    return h.hexdigest()
+
+
+def _legacy_sign(encoded_url):
+    h = _LEGACY_HMAC_PROTO.copy()
+    h.update(encoded_url.encode())
+    return h.hexdigest()[:_SIG_LEN]
 
 class Campaign(models.Model):
     """
@@ -57,7 +78,8 @@ class ShortLink(models.Model):
     blogger = models.ForeignKey(Blogger, on_delete=models.SET_NULL, null=True, blank=True, related_name='short_links')
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     original_url = models.TextField()
-    short_code = models.TextField(null=True, blank=True)
+    url_hash = models.CharField(max_length=32, editable=False, default='') # MD5 of original_url, TEXT can't be indexed on MySQL.
+    short_code = models.CharField(max_length=2048, unique=True, blank=True, db_collation='ascii_bin') # Case-sensitive and indexable on MySQL, filled by save().
     campaign = models.ForeignKey(Campaign, on_delete=models.SET_NULL,null=True, related_name="short_links")
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="short_links")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -67,64 +89,47 @@ class ShortLink(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     extra = models.JSONField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['click_count']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'url_hash'], name='unique_shortlink_campaign_url'),
+        ]
+
     ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
 
 
     @staticmethod
     def is_valid_url(url: str) -> bool:
         """
-        Validates a URL using Django's URLValidator.
+        Validates an http(s) URL using a shared URLValidator instance.
         Returns True if valid, False otherwise.
         """
-        if not url:
+        if not isinstance(url, str) or not url[:8].lower().startswith(('http://', 'https://')):
             return False
-        validator = URLValidator()
         try:
             decoded_url = unquote(url)  # Decode percent-encoded URL
-            validator(decoded_url)
+            _URL_VALIDATOR(decoded_url)
             return True
         except ValidationError:
             return False
 
 
     @staticmethod
-    def convert_request_data_to_json(request):
-        """
-        Extracts all available data from request and returns a JSON-serializable dictionary.
-        """
-        request_data = {
-            key: value for key, value in request.META.items() if isinstance(value, (str, int, float, list, dict))
-        }
-        request_data["method"] = request.method
-        request_data["path"] = request.path
-        request_data["query_params"] = request.GET.dict()
-        request_data["post_data"] = request.POST.dict()
-        return json.dumps(request_data)
-
-    @staticmethod
-    def compress_url(url):
+    def hash_url(url):
         """
-        Compresses a URL for shorter storage and easier caching.
+        Returns a fixed-size hash of a URL, used to index TextField URL lookups.
         """
-        compressed = zlib.compress(url.encode())
-        return base64.urlsafe_b64encode(compressed).decode()
-
-
-    @staticmethod
-    def decompress_url(compressed_url):
-        """
-        Decompresses a previously compressed URL.
-        """
-        compressed = base64.urlsafe_b64decode(compressed_url.encode())
-        return zlib.decompress(compressed).decode()
+        return hashlib.md5(url.encode()).hexdigest()
 
     @staticmethod
     def generate_short_code(original_url: str) -> str:
         """
-        Generates a short code for a given original URL using HMAC and base64 encoding.
+        Generates a short code for a given original URL using a keyed BLAKE2b signature and base64 encoding.
         """
         encoded_url = base64.urlsafe_b64encode(original_url.encode()).decode().rstrip('=')
-        signature = hmac.new(settings.SECRET_KEY.encode(), msg=encoded_url.encode(),digestmod=hashlib.sha256).hexdigest()[:4]
+        signature = _sign(encoded_url)
         return f"{encoded_url}{signature}"
 
 
@@ -134,14 +139,14 @@ class ShortLink(models.Model):
         Decodes a short code back to the original URL, verifying its signature.
         Raises ValueError if invalid.
         """
-        if len(short_code) <= 4:
+        if len(short_code) <= _SIG_LEN:
             raise ValueError("Short code is invalid")
 
-        encoded_url = short_code[:-4]
-        signature = short_code[-4:]
-        expected_signature = hmac.new(settings.SECRET_KEY.encode(), msg=encoded_url.encode(), digestmod=hashlib.sha256).hexdigest()[:4]
+        encoded_url = short_code[:-_SIG_LEN]
+        signature = short_code[-_SIG_LEN:].encode()
 
-        if signature != expected_signature:
+        if not (hmac.compare_digest(signature, _sign(encoded_url).encode())
+                or hmac.compare_digest(signature, _legacy_sign(encoded_url).encode())):
             raise ValueError("Signature of short code is invalid")
 
         try:
@@ -166,10 +171,12 @@ class ShortLink(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Saves the ShortLink instance, generating a short code if not present.
+        Saves the ShortLink instance, generating a short code if not present
+        and keeping the URL hash in sync with original_url.
         """
         if not self.short_code:
             self.short_code = self.generate_short_code(self.original_url)
+        self.url_hash = self.hash_url(self.original_url)
         super().save(*args, **kwargs)
 
 
@@ -180,15 +187,30 @@ class ClickLog(models.Model):
     Stores click logs for each short link, including IP, referrer, and user agent.
     """
     original_url = models.TextField() # This field relates to original_url in ShortLink table.
+    url_hash = models.CharField(max_length=32, editable=False, default='') # MD5 of original_url, TEXT can't be indexed on MySQL.
     ip_address = models.CharField(max_length=100, null=True, blank=True)
     referrer = models.CharField(max_length=100, null=True, blank=True, default=None)
     user_agent = models.CharField(max_length=255, blank=True, null=True)
     request_data = models.JSONField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(default=timezone.now) # Set by log_click at click time, kept by bulk_create.
     extra = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['url_hash', 'created_at']),
+        ]
+
     def __str__(self):
         return f"Click on {self.original_url} at {self.created_at}"
 
+    def save(self, *args, **kwargs):
+        """
+        Saves the ClickLog instance, filling the URL hash used for report lookups.
+        """
+        if not self.url_hash:
+            self.url_hash = ShortLink.hash_url(self.original_url)
+        super().save(*args, **kwargs)
+
 class BlockedIp(models.Model):
     """
     Stores blocked IP addresses and their restrictions for accessing short links.
@@ -213,24 +235,24 @@ class BlockedIp(models.Model):
         Returns True if blocked, False otherwise.
         """
         cache_key_all = f'blocked_ip_all_{ip}'
-        if cache.get(cache_key_all):
-            return True
-
         cache_key_link = f'blocked_ip_link_{ip}_{original_url}'
-        if cache.get(cache_key_link):
+        cached = cache.get_many([cache_key_all, cache_key_link])
+        if any(cached.values()):
             return True
+        if len(cached) == 2:
+            return False  # Both negatively cached
 
-        blocked_ip = BlockedIp.objects.filter(ip_address=ip, is_active=True).exists()
-        if not blocked_ip:
-            return False
+        blocked_ip = BlockedIp.objects.filter(ip_address=ip, is_active=True).values(
+            'is_blocked_for_all_url', 'blocked_links'
+        ).first()
 
-        if blocked_ip["is_blocked_for_all_url"]:
+        if blocked_ip and blocked_ip["is_blocked_for_all_url"]:
             cache.set(cache_key_all, True, timeout=900)  # 15 minute
             return True
 
-        if original_url in blocked_ip["blocked_links"]:
+        if blocked_ip and original_url in blocked_ip["blocked_links"]:
             cache.set(cache_key_link, True, timeout=900)  # 15 minute
             return True
 
+        cache.set_many({cache_key_all: False, cache_key_link: False}, timeout=60)  # 1 minute
         return False
-
@@ -2,33 +2,61 @@
 from celery import shared_task
 from django.core.cache import cache
 from urlshortener.models import ShortLink, ClickLog
-from django.db import models, transaction
+from django.db import models, transaction, DataError, IntegrityError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import json
 import redis
 import os
-REDIS_CLICK_KEY = "shortlink_click_count"
+REDIS_CLICK_KEY = os.getenv("REDIS_CLICK_KEY", "shortlink_click_count")
+REDIS_CLICK_PROCESSING_KEY = f"{REDIS_CLICK_KEY}_processing"
+CLICKLOG_BUFFER_KEY = "clicklog_buffer"
+CLICKLOG_PROCESSING_KEY = "clicklog_buffer_processing"
+CLICKLOG_DEAD_KEY = "clicklog_buffer_dead"
+CLICKLOG_FLUSH_BATCH_SIZE = 1000
+# Errors caused by the entry itself rather than the database being unavailable
+CLICKLOG_BAD_ENTRY_ERRORS = (ValueError, TypeError, KeyError, DataError, IntegrityError)
+POPULAR_CACHE_BATCH_SIZE = 500
 redis_url = os.getenv('REDIS_CACHE_URL', 'redis://localhost:6379/0')
-redis_client = redis.Redis.from_url(redis_url)
+redis_pool = redis.ConnectionPool.from_url(redis_url, max_connections=50, socket_keepalive=True)
+redis_client = redis.Redis(connection_pool=redis_pool)
+# Atomically moves up to ARGV[1] entries from the head of KEYS[1] to KEYS[2] and returns them
+_claim_script = redis_client.register_script("""
+local entries = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #entries > 0 then
+    redis.call('RPUSH', KEYS[2], unpack(entries))
+    redis.call('LTRIM', KEYS[1], #entries, -1)
+end
+return entries
+""")
 
 @shared_task(name='urlshortener_count_log_click')
 def count_log_click():
-    redis_click_key = os.getenv("REDIS_CLICK_KEY", "click_count")
-
     try:
-        click_data = redis_client.hgetall(redis_click_key)
+        # Move the counters aside so clicks arriving during the update land in a fresh hash.
+        # A processing key left by a failed run is applied first.
+        if not redis_client.exists(REDIS_CLICK_PROCESSING_KEY):
+            try:
+                redis_client.rename(REDIS_CLICK_KEY, REDIS_CLICK_PROCESSING_KEY)
+            except redis.ResponseError:
+                return False  # No clicks since the last run
+
+        click_data = redis_client.hgetall(REDIS_CLICK_PROCESSING_KEY)
         if not click_data:
             return False
 
+        click_data = {short_code.decode(): int(count) for short_code, count in click_data.items()}
+        whens = [
+            models.When(short_code=short_code, then=models.F('click_count') + count)
+            for short_code, count in click_data.items()
+        ]
+
         with transaction.atomic():
-            for compressed_url, count in click_data.items():
-                original_url = ShortLink.decompress_url(compressed_url.decode())
-                if not original_url:
-                    continue
-                ShortLink.objects.filter(original_url=original_url).update(
-                    click_count=models.F('click_count') + int(count)
-                )
-            redis_client.delete(redis_click_key)
-            return True
+            ShortLink.objects.filter(short_code__in=list(click_data)).update(
+                click_count=models.Case(*whens, output_field=models.PositiveIntegerField())
+            )
+            transaction.on_commit(lambda: redis_client.delete(REDIS_CLICK_PROCESSING_KEY))
+        return True
 
     except redis.RedisError as e:
         print(f"Redis error: {e}")
@@ -40,39 +68,119 @@ def count_log_click():
 
 
 @shared_task(name='urlshortener_log_click')
-def log_click(original_url, request_data_json):
+def log_click(short_code, original_url, click_data):
     """
-    Log a click for a given original URL and update click count in Redis.
+    Buffer a click log for a given short code and update click count in Redis.
+    click_data holds the ip, ua and ref values collected by RedirectView.
+    Buffered logs are written to the database in batches by flush_click_logs.
     """
-    request_data = json.loads(request_data_json)
-
-    # Extract key features
-    filtered_data = {
-        "ip_address": request_data.get("REMOTE_ADDR"),
-        "referrer": request_data.get("HTTP_REFERER"),
-        "user_agent": request_data.get("HTTP_USER_AGENT")
+    click_entry = {
+        "original_url": original_url,
+        "url_hash": ShortLink.hash_url(original_url),
+        "ip_address": click_data.get("ip") or "",
+        "referrer": (click_data.get("ref") or "")[:100],
+        "user_agent": (click_data.get("ua") or "")[:255],
+        "request_data": click_data,
+        "created_at": timezone.now().isoformat(),
     }
 
-    ClickLog.objects.create(
-        original_url=original_url,
-        ip_address=filtered_data.get("ip_address", ""),
-        referrer=filtered_data.get("referrer", ""),
-        user_agent=filtered_data.get("user_agent", "")[:255],
-        request_data=request_data
-    )
-    compressed_url = ShortLink.compress_url(original_url)
-
     try:
-        redis_client.hincrby(REDIS_CLICK_KEY, compressed_url, 1)
+        # Both writes go out in one round trip and apply together, so the log buffer and counter stay in step
+        with redis_client.pipeline() as pipe:
+            pipe.rpush(CLICKLOG_BUFFER_KEY, json.dumps(click_entry))
+            pipe.hincrby(REDIS_CLICK_KEY, short_code, 1)
+            pipe.execute()
     except redis.RedisError as e:
         print(f"Redis error: {e}")
         return False
 
     return True
 
+def _click_log_from_entry(entry):
+    """
+    Builds an unsaved ClickLog from a buffered JSON entry, restoring its click time.
+    """
+    data = json.loads(entry)
+    data["created_at"] = parse_datetime(data["created_at"])
+    return ClickLog(**data)
+
+def _claim_click_logs():
+    """
+    Returns the entries of the processing list, moving the next batch from the buffer into it first
+    when it is empty. A non-empty processing list was left by an interrupted run and is retried as is.
+    """
+    entries = redis_client.lrange(CLICKLOG_PROCESSING_KEY, 0, -1)
+    if entries:
+        return entries
+    return _claim_script(keys=[CLICKLOG_BUFFER_KEY, CLICKLOG_PROCESSING_KEY], args=[CLICKLOG_FLUSH_BATCH_SIZE])
+
+def _flush_click_logs_one_by_one(entries):
+    """
+    Inserts claimed click logs individually, moving entries that can't be stored to the dead-letter list.
+    Each entry leaves the processing list as soon as it is handled. Returns the number of entries inserted.
+    """
+    flushed = 0
+    for entry in entries:
+        try:
+            with transaction.atomic():
+                _click_log_from_entry(entry).save()
+            flushed += 1
+            redis_client.lpop(CLICKLOG_PROCESSING_KEY)
+        except CLICKLOG_BAD_ENTRY_ERRORS as e:
+            print(f"Moving bad click log entry to {CLICKLOG_DEAD_KEY}: {e}")
+            with redis_client.pipeline() as pipe:
+                pipe.rpush(CLICKLOG_DEAD_KEY, entry)
+                pipe.lpop(CLICKLOG_PROCESSING_KEY)
+                pipe.execute()
+    return flushed
+
+@shared_task(name='urlshortener_flush_click_logs')
+def flush_click_logs():
+    """
+    Move buffered click logs from Redis to the database using bulk inserts.
+    Entries are claimed into a processing list and only removed once they are stored,
+    so a crash or a database outage leaves them to be retried on the next run.
+    """
+    flushed = 0
+    try:
+        while True:
+            entries = _claim_click_logs()
+            if not entries:
+                break
+
+            try:
+                with transaction.atomic():
+                    ClickLog.objects.bulk_create(
+                        [_click_log_from_entry(entry) for entry in entries],
+                        batch_size=CLICKLOG_FLUSH_BATCH_SIZE,
+                    )
+                redis_client.delete(CLICKLOG_PROCESSING_KEY)
+                flushed += len(entries)
+            except CLICKLOG_BAD_ENTRY_ERRORS:
+                # A bad entry fails the whole batch, so insert one by one and set bad entries aside
+                flushed += _flush_click_logs_one_by_one(entries)
+
+    except redis.RedisError as e:
+        print(f"Redis error: {e}")
+    except Exception as e:
+        print(f"Error flushing click logs: {e}")
+
+    return flushed
+
 @shared_task(name='urlshortener_cache_popular_urls')
 def cache_popular_urls():
-    popular_links = ShortLink.objects.filter(click_count__gte=30).values_list('short_code', 'original_url')
-    for short_code, original_url in popular_links:
-        cache.set(f'short_link_{short_code}', original_url, timeout=3600*24)
+    """
+    Cache the original URL of popular short links for a day, written to Redis in batches.
+    """
+    popular_links = ShortLink.objects.filter(click_count__gte=30).values_list(
+        'short_code', 'original_url'
+    ).iterator(chunk_size=POPULAR_CACHE_BATCH_SIZE)
 
+    batch = {}
+    for short_code, original_url in popular_links:
+        batch[f'short_link_{short_code}'] = original_url
+        if len(batch) >= POPULAR_CACHE_BATCH_SIZE:
+            cache.set_many(batch, timeout=3600*24)
+            batch.clear()
+    if batch:
+        cache.set_many(batch, timeout=3600*24)
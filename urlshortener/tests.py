@@ -1,3 +1,480 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import json
+from contextlib import chdir
+from datetime import timedelta
+from tempfile import TemporaryDirectory
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from urlshortener import tasks
+from urlshortener.models import BlockedIp, Campaign, ClickLog, ShortLink
+from urlshortener.views import RedirectView, ShortenURLAPI
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def legacy_short_code(url):
+    """Builds a short code the way it was signed before the BLAKE2b switch."""
+    encoded_url = base64.urlsafe_b64encode(url.encode()).decode().rstrip('=')
+    signature = hmac.new(settings.SECRET_KEY.encode(), encoded_url.encode(), hashlib.sha256).hexdigest()[:4]
+    return encoded_url + signature
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the subset of the redis client used by urlshortener.tasks.
+    """
+    def __init__(self):
+        self.data = {}
+
+    @staticmethod
+    def _bytes(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def rename(self, src, dst):
+        if src not in self.data:
+            raise tasks.redis.ResponseError("no such key")
+        self.data[dst] = self.data.pop(src)
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(self._bytes(v) for v in values)
+
+    def lpush(self, key, *values):
+        for value in values:
+            self.data.setdefault(key, []).insert(0, self._bytes(value))
+
+    def lpop(self, key, count=None):
+        items = self.data.get(key, [])
+        popped = items[:count or 1]
+        del items[:count or 1]
+        if not items:
+            self.data.pop(key, None)
+        if count is None:
+            return popped[0] if popped else None
+        return popped or None
+
+    def lrange(self, key, start, end):
+        items = self.data.get(key, [])
+        return items[start:] if end == -1 else items[start:end + 1]
+
+    def hincrby(self, key, field, amount=1):
+        hash_ = self.data.setdefault(key, {})
+        field = self._bytes(field)
+        hash_[field] = self._bytes(int(hash_.get(field, b'0')) + amount)
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def claim_script(self, keys, args):
+        """Python version of tasks._claim_script."""
+        entries = self.lpop(keys[0], count=int(args[0])) or []
+        if entries:
+            self.rpush(keys[1], *entries)
+        return entries
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+class FakeRedisTestCase(TestCase):
+    """
+    Runs tests with urlshortener.tasks talking to a FakeRedis instance.
+    """
+    def setUp(self):
+        self.redis = FakeRedis()
+        for target, value in (('redis_client', self.redis), ('_claim_script', self.redis.claim_script)):
+            patcher = mock.patch.object(tasks, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BlockedIpTests(TestCase):
+    """
+    Tests for BlockedIp.is_blocked_ip and its cache handling.
+    """
+    ip = '10.0.0.1'
+    url = 'https://example.com/a'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_ip_blocked_for_all_urls(self):
+        BlockedIp.objects.create(ip_address=self.ip, is_blocked_for_all_url=True)
+
+        self.assertTrue(BlockedIp.is_blocked_ip(self.ip, self.url))
+        self.assertTrue(BlockedIp.is_blocked_ip(self.ip, 'https://example.com/other'))
+        self.assertIs(cache.get(f'blocked_ip_all_{self.ip}'), True)
+
+    def test_ip_blocked_for_link(self):
+        BlockedIp.objects.create(ip_address=self.ip, blocked_links=[self.url])
+
+        self.assertTrue(BlockedIp.is_blocked_ip(self.ip, self.url))
+        self.assertFalse(BlockedIp.is_blocked_ip(self.ip, 'https://example.com/other'))
+        self.assertIs(cache.get(f'blocked_ip_link_{self.ip}_{self.url}'), True)
+
+    def test_unknown_ip_is_negatively_cached(self):
+        self.assertFalse(BlockedIp.is_blocked_ip(self.ip, self.url))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(BlockedIp.is_blocked_ip(self.ip, self.url))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RedirectThrottleTests(TestCase):
+    """
+    Tests for the per-IP rate limit on RedirectView.
+    """
+    url = 'https://example.com/a'
+
+    def setUp(self):
+        cache.clear()
+        self.view = RedirectView.as_view()
+        self.short_code = ShortLink.generate_short_code(self.url)
+
+    def get(self, **headers):
+        request = RequestFactory().get(f'/api/{self.short_code}/', REMOTE_ADDR='10.0.0.2', **headers)
+        return self.view(request, short_code=self.short_code)
+
+    @mock.patch('urlshortener.views.time.time', return_value=1000.0)
+    @mock.patch('urlshortener.views.log_click')
+    def test_eleventh_request_is_throttled(self, log_click, _time):
+        for _ in range(10):
+            response = self.get()
+            self.assertEqual(response.status_code, 301)
+            self.assertEqual(response['Location'], self.url)
+
+        response = self.get()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(log_click.delay.call_count, 10)
+
+    @mock.patch('urlshortener.views.time.time', return_value=1000.0)
+    @mock.patch('urlshortener.views.log_click')
+    def test_spoofed_forwarded_for_does_not_bypass_limit(self, log_click, _time):
+        for i in range(10):
+            self.assertEqual(self.get(HTTP_X_FORWARDED_FOR=f'192.0.2.{i}').status_code, 301)
+
+        self.assertEqual(self.get(HTTP_X_FORWARDED_FOR='192.0.2.99').status_code, 429)
+        self.assertEqual(log_click.delay.call_args.args[2]['ip'], '10.0.0.2')
+
+    @mock.patch('urlshortener.views.log_click')
+    def test_forwarded_ip_is_used_behind_trusted_proxy(self, log_click):
+        BlockedIp.objects.create(ip_address='192.0.2.1', is_blocked_for_all_url=True)
+
+        with override_settings(REST_FRAMEWORK={'NUM_PROXIES': 1}):
+            self.assertEqual(self.get(HTTP_X_FORWARDED_FOR='192.0.2.1').status_code, 403)
+            self.assertEqual(self.get(HTTP_X_FORWARDED_FOR='192.0.2.2').status_code, 301)
+        self.assertEqual(log_click.delay.call_args.args[2]['ip'], '192.0.2.2')
+
+
+class FlushClickLogsTests(FakeRedisTestCase):
+    """
+    Tests for buffering clicks in log_click and storing them in flush_click_logs.
+    """
+    url = 'https://example.com/a'
+
+    def log_clicks(self, count):
+        for _ in range(count):
+            tasks.log_click('code', self.url, {'ip': '10.0.0.1', 'ua': 'agent', 'ref': 'x' * 200})
+
+    def test_flush_stores_buffered_clicks_with_click_time(self):
+        self.log_clicks(2)
+        clicked_at = json.loads(self.redis.data[tasks.CLICKLOG_BUFFER_KEY][0])['created_at']
+
+        self.assertEqual(tasks.flush_click_logs(), 2)
+
+        logs = ClickLog.objects.all()
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(logs[0].created_at.isoformat(), clicked_at)
+        self.assertEqual(logs[0].url_hash, ShortLink.hash_url(self.url))
+        self.assertEqual(len(logs[0].referrer), 100)
+        self.assertEqual(self.redis.data, {tasks.REDIS_CLICK_KEY: {b'code': b'2'}})
+
+    def test_bad_entry_goes_to_dead_letter_list(self):
+        self.log_clicks(1)
+        self.redis.rpush(tasks.CLICKLOG_BUFFER_KEY, 'not json')
+        self.log_clicks(1)
+
+        self.assertEqual(tasks.flush_click_logs(), 2)
+
+        self.assertEqual(ClickLog.objects.count(), 2)
+        self.assertEqual(self.redis.data[tasks.CLICKLOG_DEAD_KEY], [b'not json'])
+        self.assertNotIn(tasks.CLICKLOG_PROCESSING_KEY, self.redis.data)
+        self.assertNotIn(tasks.CLICKLOG_BUFFER_KEY, self.redis.data)
+
+    def test_database_error_keeps_claimed_entries_for_next_run(self):
+        self.log_clicks(3)
+
+        with mock.patch.object(ClickLog.objects, 'bulk_create', side_effect=OperationalError):
+            self.assertEqual(tasks.flush_click_logs(), 0)
+        self.assertEqual(len(self.redis.data[tasks.CLICKLOG_PROCESSING_KEY]), 3)
+        self.assertEqual(ClickLog.objects.count(), 0)
+
+        self.log_clicks(1)
+        self.assertEqual(tasks.flush_click_logs(), 4)
+        self.assertEqual(ClickLog.objects.count(), 4)
+        self.assertNotIn(tasks.CLICKLOG_PROCESSING_KEY, self.redis.data)
+
+
+class CountLogClickTests(FakeRedisTestCase):
+    """
+    Tests for applying the Redis click counters to ShortLink.click_count.
+    """
+    def setUp(self):
+        super().setUp()
+        self.link_a = ShortLink.objects.create(original_url='https://example.com/a')
+        self.link_b = ShortLink.objects.create(original_url='https://example.com/b')
+
+    def count(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return tasks.count_log_click()
+
+    def test_counts_are_applied_in_one_update(self):
+        self.redis.hincrby(tasks.REDIS_CLICK_KEY, self.link_a.short_code, 3)
+        self.redis.hincrby(tasks.REDIS_CLICK_KEY, self.link_b.short_code, 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.count())
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+
+        self.link_a.refresh_from_db()
+        self.link_b.refresh_from_db()
+        self.assertEqual((self.link_a.click_count, self.link_b.click_count), (3, 1))
+
+    def test_clicks_arriving_during_update_are_kept(self):
+        self.redis.hincrby(tasks.REDIS_CLICK_KEY, self.link_a.short_code, 2)
+        hgetall = self.redis.hgetall
+
+        def hgetall_then_click(key):
+            result = hgetall(key)
+            self.redis.hincrby(tasks.REDIS_CLICK_KEY, self.link_a.short_code, 1)
+            return result
+
+        with mock.patch.object(self.redis, 'hgetall', hgetall_then_click):
+            self.assertTrue(self.count())
+
+        self.assertNotIn(tasks.REDIS_CLICK_PROCESSING_KEY, self.redis.data)
+        self.assertEqual(self.redis.data[tasks.REDIS_CLICK_KEY], {self.link_a.short_code.encode(): b'1'})
+        self.link_a.refresh_from_db()
+        self.assertEqual(self.link_a.click_count, 2)
+
+    def test_leftover_processing_key_is_applied_first(self):
+        self.redis.hincrby(tasks.REDIS_CLICK_PROCESSING_KEY, self.link_a.short_code, 5)
+        self.redis.hincrby(tasks.REDIS_CLICK_KEY, self.link_a.short_code, 1)
+
+        self.assertTrue(self.count())
+        self.link_a.refresh_from_db()
+        self.assertEqual(self.link_a.click_count, 5)
+
+        self.assertTrue(self.count())
+        self.link_a.refresh_from_db()
+        self.assertEqual(self.link_a.click_count, 6)
+        self.assertFalse(self.count())
+
+
+class ShortenURLAPITests(TestCase):
+    """
+    Tests for creating short links through ShortenURLAPI.
+    """
+    url = 'https://example.com/a?utm_source=x'
+    canonical_url = 'https://example.com/a'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.campaign_a = Campaign.objects.create(name='A')
+        self.campaign_b = Campaign.objects.create(name='B')
+
+    def shorten(self, campaign, url=None):
+        return self.client.post('/api/shorten/', {'url': url or self.url, 'campaign_id': campaign.id}, format='json')
+
+    def test_new_url_is_created_once(self):
+        response = self.shorten(self.campaign_a)
+        self.assertEqual(response.status_code, 201)
+        short_link = ShortLink.objects.get()
+        self.assertEqual(short_link.original_url, self.canonical_url)
+        self.assertTrue(response.data['short_url'].endswith(f'/{short_link.short_code}'))
+
+        response = self.shorten(self.campaign_a)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['short_url'].endswith(f'/{short_link.short_code}'))
+        self.assertEqual(ShortLink.objects.count(), 1)
+
+    def test_url_of_another_campaign_is_rejected(self):
+        self.assertEqual(self.shorten(self.campaign_a).status_code, 201)
+
+        response = self.shorten(self.campaign_b)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(ShortLink.objects.count(), 1)
+
+    def test_url_with_legacy_code_of_another_campaign_is_rejected(self):
+        ShortLink.objects.create(
+            original_url=self.canonical_url, short_code=legacy_short_code(self.canonical_url), campaign=self.campaign_a
+        )
+
+        response = self.shorten(self.campaign_b)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(ShortLink.objects.count(), 1)
+
+    def test_url_with_legacy_code_is_returned_for_its_campaign(self):
+        short_code = legacy_short_code(self.canonical_url)
+        ShortLink.objects.create(original_url=self.canonical_url, short_code=short_code, campaign=self.campaign_a)
+
+        response = self.shorten(self.campaign_a)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['short_url'].endswith(f'/{short_code}'))
+
+    def test_concurrently_created_link_is_returned(self):
+        short_link = ShortLink.objects.create(original_url=self.canonical_url, campaign=self.campaign_a)
+        find_campaign_link = ShortenURLAPI._find_campaign_link
+        results = iter([(None, False)])
+
+        def stale_then_real(lookup, campaign):
+            return next(results, None) or find_campaign_link(lookup, campaign)
+
+        with mock.patch.object(ShortenURLAPI, '_find_campaign_link', side_effect=stale_then_real):
+            response = self.shorten(self.campaign_a)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['short_url'].endswith(f'/{short_link.short_code}'))
+
+        results = iter([(None, False)])
+        with mock.patch.object(ShortenURLAPI, '_find_campaign_link', side_effect=stale_then_real):
+            response = self.shorten(self.campaign_b)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(ShortLink.objects.count(), 1)
+
+
+class AddLinkApiTests(TestCase):
+    """
+    Tests for importing the bundled links file through AddLinkApi.
+    """
+    def test_admin_imports_links_from_any_working_directory(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('admin', is_staff=True))
+
+        with TemporaryDirectory() as cwd, chdir(cwd):
+            response = client.get('/api/add_links/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(response.data['submitted'], 0)
+        self.assertTrue(ShortLink.objects.filter(campaign__name='Digikala').exists())
+
+    def test_non_admin_is_rejected(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('user'))
+
+        self.assertEqual(client.get('/api/add_links/').status_code, 403)
+
+
+class ShortCodeTests(TestCase):
+    """
+    Tests for signing and decoding short codes.
+    """
+    url = 'https://example.com/a'
+
+    def test_current_code_round_trips(self):
+        self.assertEqual(ShortLink.decode_short_code(ShortLink.generate_short_code(self.url)), self.url)
+
+    def test_legacy_code_is_accepted(self):
+        self.assertEqual(ShortLink.decode_short_code(legacy_short_code(self.url)), self.url)
+
+    def test_tampered_code_is_rejected(self):
+        short_code = ShortLink.generate_short_code(self.url)
+        for bad_code in (short_code[:-4] + 'zzzz', 'ab', short_code[:-4] + 'é' * 4):
+            with self.assertRaises(ValueError):
+                ShortLink.decode_short_code(bad_code)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ClickReportAPITests(TestCase):
+    """
+    Tests for the paginated click report of a short link and who may read it.
+    """
+    url = 'https://example.com/a'
+
+    def setUp(self):
+        self.owner = User.objects.create_user('owner')
+        self.short_link = ShortLink.objects.create(original_url=self.url, created_by=self.owner, click_count=7)
+        now = timezone.now()
+        ClickLog.objects.bulk_create(
+            [ClickLog(original_url=self.url, url_hash=ShortLink.hash_url(self.url), ip_address=f'10.0.0.{i}',
+                      created_at=now - timedelta(minutes=i)) for i in range(5)]
+            + [ClickLog(original_url='https://example.com/b', url_hash=ShortLink.hash_url('https://example.com/b'))]
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def report(self, **params):
+        return self.client.get(f'/api/report/{self.short_link.short_code}/', params)
+
+    def test_clicks_are_paginated_newest_first(self):
+        response = self.report(limit=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_clicks'], 7)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([click['ip_address'] for click in response.data['clicks']], ['10.0.0.0', '10.0.0.1'])
+        self.assertIn('offset=2', response.data['next'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.report(limit=2, offset=4)
+        self.assertEqual([click['ip_address'] for click in response.data['clicks']], ['10.0.0.4'])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_default_limit_applies(self):
+        with mock.patch('urlshortener.views.ClickLogPagination.default_limit', 3):
+            response = self.report()
+        self.assertEqual(len(response.data['clicks']), 3)
+        self.assertIn('limit=3', response.data['next'])
+
+    def test_unknown_short_code_is_not_found(self):
+        self.assertEqual(self.client.get('/api/report/unknown/').status_code, 404)
+
+    def test_other_user_is_denied(self):
+        self.client.force_authenticate(User.objects.create_user('other'))
+        self.assertEqual(self.report().status_code, 403)
+
+    def test_staff_user_can_read_any_report(self):
+        self.client.force_authenticate(User.objects.create_user('staff', is_staff=True))
+        response = self.report()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+
+    def test_anonymous_user_is_denied(self):
+        self.client.force_authenticate(None)
+        self.assertIn(self.report().status_code, (401, 403))
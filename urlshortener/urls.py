@@ -8,6 +8,7 @@ app_name = 'shortener'
 urlpatterns = [
     path('shorten/', ShortenURLAPI.as_view(), name='shorten-url'),
     path('report/<str:short_code>/', ClickReportAPI.as_view(), name='click-report'),
+    path('add_links/', AddLinkApi.as_view()),
+    # Catch-all for short codes, keep it last so it doesn't shadow the routes above
     path('<str:short_code>/', RedirectView.as_view(), name='redirect'),
-    path('add_links/', AddLinkApi.as_view())
 ]
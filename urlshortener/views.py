@@ -1,6 +1,10 @@
 # urlshortener/views.py
-from django.shortcuts import redirect, get_object_or_404
+from django.shortcuts import get_object_or_404
 from django.core.cache import cache
+from django.db import transaction, IntegrityError
+from django.db.models import Q
+from django.http import JsonResponse, HttpResponsePermanentRedirect
+from django.views import View
 import redis
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
@@ -8,25 +12,49 @@ from rest_framework.response import Response
 from rest_framework import status, permissions
 from urlshortener.models import ShortLink, Campaign, ClickLog, BlockedIp
 from urlshortener.tasks import log_click
-from rest_framework.throttling import SimpleRateThrottle
+from urlshortener.add import extract_links_data_to_models
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.throttling import BaseThrottle
 from django.conf import settings
-import os
-import json
+import math
+import time
 
 
-class CustomRedirectThrottle(SimpleRateThrottle):
+class CustomRedirectThrottle(BaseThrottle):
     """
     Custom rate throttle for redirect requests.
-    Limits the number of redirects per IP to prevent abuse.
+    Limits the number of redirects per IP to prevent abuse, using a fixed-window counter in the cache.
+    The client IP is resolved by DRF's get_ident, which only trusts X-Forwarded-For behind NUM_PROXIES proxies.
     """
-    scope = 'custom_redirect'
-    rate = '10/minute'  # Limit to 10 requests per minute
+    rate = 10  # Limit to 10 requests per minute
+    duration = 60
 
-    def get_cache_key(self, request, view):
+    def allow_request(self, request, view):
         """
-        Returns a unique cache key for the request based on the client IP.
+        Counts the request for the client IP and returns False once the limit is exceeded.
         """
-        return self.get_ident(request)
+        window = int(time.time() // self.duration)
+        key = f'throttle_custom_redirect_{self.get_ident(request)}_{window}'
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # First request in this window; another request may have opened it meanwhile
+            count = 1 if cache.add(key, 1, timeout=self.duration) else cache.incr(key)
+        return count <= self.rate
+
+    def wait(self):
+        """
+        Returns the number of seconds until the current window ends.
+        """
+        return self.duration - time.time() % self.duration
+
+
+class ClickLogPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination for click logs in the click report.
+    """
+    default_limit = 100
+    max_limit = 1000
 
 
 class AddLinkApi(APIView):
@@ -34,60 +62,65 @@ class AddLinkApi(APIView):
     API endpoint to add links from a JSON file to the database.
     Reads links from json/links.json and creates ShortLink objects for valid URLs.
     """
+    permission_classes = [permissions.IsAdminUser]
+
     def get(self, request):
         """
         Reads links from a JSON file and adds them to the database under the 'Digikala' campaign.
         """
-        file_path = os.path.join('json', 'links.json')
-        print(file_path)
-        with open(file_path, 'r', encoding='utf-8') as file:
-            links = json.load(file)['links']
+        submitted, invalid = extract_links_data_to_models()
+        return Response({"submitted": submitted, "invalid": invalid}, status=status.HTTP_200_OK)
 
-        campaign, created = Campaign.objects.get_or_create(name="Digikala")
 
-        for link in links:
-            if ShortLink.is_valid_url(link):
-                short_link, created = ShortLink.objects.get_or_create(original_url=link, campaign=campaign)
-                if created:
-                    print(f"Created ShortLink for {link}")
-                else:
-                    print(f"ShortLink for {link} already exists")
-            else:
-                print(f"Invalid URL: {link}")
+def _resolve_short_code(short_code):
+    """
+    Decodes a short code for caching. Returns the original URL, or an error dict if the code is invalid.
+    """
+    try:
+        return ShortLink.decode_short_code(short_code)
+    except ValueError as e:
+        return {"error": str(e)}
 
 
-class RedirectView(APIView):
+class RedirectView(View):
     """
-    API endpoint to redirect a short code to its original URL.
+    Endpoint to redirect a short code to its original URL.
+    A plain Django view, since DRF's parsing and content negotiation aren't needed on the hot path.
     Uses cache and checks for blocked IPs before redirecting.
     """
-    throttle_classes = [CustomRedirectThrottle]
+    throttle = CustomRedirectThrottle()
 
     def get(self, request, short_code):
         """
         Redirects to the original URL for the given short code.
         Caches the result and logs the click asynchronously.
         """
-        # Check if the URL is cached
-        ip = request.META.get('REMOTE_ADDR')
-        cached_url = cache.get(f'short_link_{short_code}')
-        request_data_json = ShortLink.convert_request_data_to_json(request)
-
-        if cached_url:
-            if BlockedIp.is_blocked_ip(ip, cached_url):
-                return Response({"status": "blocked"}, status=403)
-            log_click.delay(cached_url, request_data_json)
-            return redirect(cached_url, permanent=True)
-
-        try:
-            original_url = ShortLink.decode_short_code(short_code)
-            if BlockedIp.is_blocked_ip(ip, original_url):
-                return Response({"status": "blocked"}, status=403)
-            cache.set(f'short_link_{short_code}', original_url, timeout=1200)  # Cache for 20 min
-            log_click.delay(original_url, request_data_json)
-            return redirect(original_url, permanent=True)
-        except ValueError as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not self.throttle.allow_request(request, self):
+            response = JsonResponse({"detail": "Request was throttled."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+            response['Retry-After'] = str(math.ceil(self.throttle.wait()))
+            return response
+
+        # The same client IP is used for the throttle, the block check and the click log
+        ip = self.throttle.get_ident(request)
+        cache_key = f'short_link_{short_code}'
+        original_url = cache.get(cache_key)
+        if original_url is None:
+            # Invalid codes are cached too, for 1 minute only, so they don't bypass the cache
+            original_url = _resolve_short_code(short_code)
+            cache.set(cache_key, original_url, timeout=60 if isinstance(original_url, dict) else 1200)  # 20 min
+        if isinstance(original_url, dict):
+            return JsonResponse(original_url, status=status.HTTP_400_BAD_REQUEST)
+
+        if BlockedIp.is_blocked_ip(ip, original_url):
+            return JsonResponse({"status": "blocked"}, status=403)
+
+        click_data = {
+            'ip': ip,
+            'ua': request.META.get('HTTP_USER_AGENT', '')[:255],
+            'ref': request.META.get('HTTP_REFERER', ''),
+        }
+        log_click.delay(short_code, original_url, click_data)
+        return HttpResponsePermanentRedirect(original_url)
 
 
 class ShortenURLAPI(APIView):
@@ -97,6 +130,16 @@ class ShortenURLAPI(APIView):
     """
     # permission_classes = [IsAuthenticated]
 
+    @staticmethod
+    def _find_campaign_link(lookup, campaign):
+        """
+        Returns (link, conflict): the campaign's link matching lookup, and whether
+        a match exists only under another campaign.
+        """
+        existing_links = list(ShortLink.objects.filter(lookup).only('short_code', 'campaign_id')[:2])
+        short_link = next((link for link in existing_links if link.campaign_id == campaign.id), None)
+        return short_link, short_link is None and bool(existing_links)
+
     def post(self, request):
         """
         Shortens a URL and associates it with a campaign.
@@ -120,27 +163,36 @@ class ShortenURLAPI(APIView):
         if not campaign:
             return Response({"error": "Invalid campaign ID"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if the URL already exists
-        existing_link = ShortLink.objects.filter(original_url=canonical_url, campaign=campaign).first()
-        if existing_link:
-            return Response({"short_url": f"{settings.DOMAINS['local']}/{existing_link.short_code}"},
-                            status=status.HTTP_200_OK)
-
-        # Create a new short link
-        short_link = ShortLink.objects.create(
-            original_url=canonical_url,
-            campaign=campaign,
-            # created_by=request.user
-        )
-        # Generate the short code
-        generated_code = ShortLink.generate_short_code(original_url)
-        while ShortLink.objects.filter(short_code=generated_code).exists():
-            generated_code = ShortLink.generate_short_code(original_url)
-
-        short_link.short_code = generated_code
-        short_link.save()
-
-        return Response({"short_url": generated_code}, status=status.HTTP_201_CREATED)
+        # Look links up by URL rather than by code: links shortened before the signature change keep
+        # their old code, and the URL may already belong to another campaign under either code.
+        short_code = ShortLink.generate_short_code(canonical_url)
+        lookup = Q(url_hash=ShortLink.hash_url(canonical_url), original_url=canonical_url)
+        short_link, conflict = self._find_campaign_link(lookup, campaign)
+
+        created = False
+        if short_link is None and not conflict:
+            try:
+                with transaction.atomic():
+                    short_link = ShortLink.objects.create(
+                        short_code=short_code,
+                        original_url=canonical_url,
+                        campaign=campaign,
+                        # created_by=request.user,
+                    )
+                created = True
+            except IntegrityError:
+                # A concurrent request created the link first
+                short_link, conflict = self._find_campaign_link(lookup, campaign)
+                conflict = conflict or short_link is None
+
+        if conflict:
+            # The code is already taken by another campaign; handing it out would credit clicks there
+            return Response({"error": "URL is already shortened for another campaign"},
+                            status=status.HTTP_409_CONFLICT)
+
+        short_url = f"{settings.ALLOWED_DOMAINS[settings.DEFAULT_DOMAIN]}/{short_link.short_code}"
+        return Response({"short_url": short_url},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
 
 class ClickReportAPI(APIView):
@@ -154,15 +206,24 @@ class ClickReportAPI(APIView):
         """
         Returns click statistics and logs for the given short code.
         """
-        short_link = get_object_or_404(ShortLink, short_code=short_code)
-        if short_link.created_by != request.user and not request.user.is_staff:
+        short_link = get_object_or_404(
+            ShortLink.objects.only('original_url', 'click_count', 'created_by_id'), short_code=short_code
+        )
+        if short_link.created_by_id != request.user.id and not request.user.is_staff:
             return Response({"error": "permission denied"}, status=status.HTTP_403_FORBIDDEN)
 
-        click_logs = ClickLog.objects.filter(original_url=short_link.original_url).only('ip_address', 'referrer',
-                                                                                        'timestamp', 'user_agent',
-                                                                                        'request_data')
+        click_logs = ClickLog.objects.filter(
+            url_hash=ShortLink.hash_url(short_link.original_url),
+            original_url=short_link.original_url,
+        ).only('ip_address', 'referrer', 'created_at', 'user_agent', 'request_data').order_by('-created_at')
+
+        paginator = ClickLogPagination()
+        page = paginator.paginate_queryset(click_logs, request, view=self)
         data = {
             "total_clicks": short_link.click_count,
+            "count": paginator.count,
+            "next": paginator.get_next_link(),
+            "previous": paginator.get_previous_link(),
             "clicks": [
                 {
                     "ip_address": log.ip_address,
@@ -171,7 +232,7 @@ class ClickReportAPI(APIView):
                     "user_agent": log.user_agent,
                     "request_data": log.request_data,
                 }
-                for log in click_logs
+                for log in page
             ]
         }
         return Response(data, status=status.HTTP_200_OK)